@@ -0,0 +1,123 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import sqlite3
+import sys
+from bot_db import BotDatabase, format_ban, format_game_sighting, format_line_numbers, format_player_sighting, format_zt_member, parse_ban_list
+from typing import Any, AsyncGenerator, Callable, Dict, Iterable
+
+# Only bot_db is imported so the tool starts quickly and works without discord or a gateway connection
+
+
+def emit(lines: Iterable[str], asJson: bool) -> None:
+    for line in lines:
+        sys.stdout.write((json.dumps(line) if asJson else line) + '\n')
+    sys.stdout.flush()
+
+
+async def emit_rows(rows: AsyncGenerator[Dict[str, Any], None], asJson: bool, format: Callable[[Dict[str, Any]], Iterable[str]]) -> None:
+    # Rows are written as they are read, as one JSON object per line for scripts. The query is closed
+    #  right away when writing fails, e.g. when piped into head, rather than after the database is closed.
+    async with contextlib.aclosing(rows):
+        async for row in rows:
+            for line in [json.dumps(row)] if asJson else format(row):
+                sys.stdout.write(line + '\n')
+    sys.stdout.flush()
+
+
+async def run_command(args: Any) -> None:
+    # Lookups open the database read-only, so they are safe to run next to the bot
+    async with BotDatabase(args.db, readOnly=args.command in read_only_commands) as db:
+        try:
+            await run_database_command(db, args)
+        except BrokenPipeError:
+            # The reader went away, e.g. head, point stdout at devnull so the final flush at exit doesn't fail too
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+
+
+async def run_database_command(db: BotDatabase, args: Any) -> None:
+    match args.command:
+        case 'findplayer':
+            await emit_rows(db.iter_player_sightings(args.name), args.json, format_player_sighting)
+        case 'findgame':
+            await emit_rows(db.iter_game_sightings(args.name), args.json, format_game_sighting)
+        case 'findmember':
+            member = await db.get_zt_member(args.ztid)
+            if member:
+                emit([json.dumps(member) if args.json else format_zt_member(member, 'Seen')], False)
+        case 'listmembers':
+            await emit_rows(db.iter_zt_members(), args.json, lambda member: [format_zt_member(member, 'Last seen')])
+        case 'listbans':
+            await emit_rows(db.iter_bans(), args.json, lambda ban: [format_ban(ban)])
+        case 'exportbans':
+            addresses = await db.export_bans()
+            emit([json.dumps({'address': address}) for address in addresses] if args.json else addresses, False)
+        case 'stats':
+            emit(await db.activity_stats(args.days), args.json)
+        case 'ban':
+            count, invalid = await db.ban_many(args.ip)
+            emit([f'Banned {count} IP addresses'] + [f'Invalid IP address or prefix: {args.ip[i]}' for i in invalid], args.json)
+        case 'revoke':
+            for ip in args.ip:
+                address, removed = await db.remove_ban(ip)
+                emit([f'Revoked ban on {address}' if removed else f'{address} is not banned'], args.json)
+        case 'importbans':
+            with (open(args.file, encoding='utf-8', errors='replace') if args.file != '-' else sys.stdin) as file:
+                addresses, lineNumbers = parse_ban_list(file.read())
+            count, invalid = await db.ban_many(addresses)
+            emit([f'Banned {count} IP addresses'] + ([format_line_numbers([lineNumbers[i] for i in invalid])] if invalid else []), args.json)
+        case 'cleanup':
+            await db.clean_up()
+            await db.prune_names()
+            emit(['Removed expired sightings, members, bans and unused names'], args.json)
+        case 'compact':
+            await db.compact()
+            emit(['Compacted database'], args.json)
+        case 'backup':
+            await db.backup(args.target, args.keep)
+            emit([f'Backed up database to {args.target}'], args.json)
+
+
+read_only_commands = ('findplayer', 'findgame', 'findmember', 'listmembers', 'listbans', 'exportbans', 'stats')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Queries and maintains the discord_bot database without connecting to Discord.')
+    parser.add_argument('--db', default='./bot_data.db', help='The path to the bot database.')
+    parser.add_argument('--json', action='store_true', help='Print lookup results as one JSON object per line, and other output as JSON strings.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('findplayer', help='Finds games a player was seen in.')
+    command.add_argument('name', help='The name of the player.')
+    command = commands.add_parser('findgame', help='Finds players that were seen playing in a game.')
+    command.add_argument('name', help='The name of the game.')
+    command = commands.add_parser('findmember', help='Finds info about a ZeroTier member.')
+    command.add_argument('ztid', help='The ZeroTier Member ID (ztid) of the player.')
+    commands.add_parser('listmembers', help='Lists info about recently seen ZeroTier members.')
+    commands.add_parser('listbans', help='Lists recently banned IP addresses.')
+    commands.add_parser('exportbans', help='Prints all banned IP addresses and ranges, one per line.')
+    command = commands.add_parser('stats', help='Shows game activity statistics.')
+    command.add_argument('--days', type=int, default=30, help='The number of days to include.')
+    command = commands.add_parser('ban', help='Bans IP addresses or CIDR ranges from using ZeroTier.')
+    command.add_argument('ip', nargs='+', help='The physical IP addresses or CIDR prefixes to ban.')
+    command = commands.add_parser('revoke', help='Revokes previously banned IP addresses or ranges.')
+    command.add_argument('ip', nargs='+', help='The physical IP addresses or CIDR prefixes that were banned.')
+    command = commands.add_parser('importbans', help='Bans every IP address or range in a ban list file.')
+    command.add_argument('file', help='The ban list file, one address or prefix per line, or - for stdin.')
+    commands.add_parser('cleanup', help='Removes expired sightings, members and bans, and names no sighting refers to.')
+    commands.add_parser('compact', help='Rebuilds the database to reclaim free space. Blocks bot writes while it runs.')
+    command = commands.add_parser('backup', help='Copies the database to a snapshot file using the online backup API.')
+    command.add_argument('target', help='The path of the snapshot file.')
+    command.add_argument('--keep', type=int, default=3, help='The number of snapshots to keep.')
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(run_command(args))
+    except (OSError, RuntimeError, sqlite3.Error) as e:
+        parser.exit(1, f'{parser.prog}: error: {e}\n')
+
+
+if __name__ == '__main__':
+    main()
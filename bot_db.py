@@ -1,7 +1,12 @@
 import aiosqlite
-from ipaddress import IPv6Address
+import asyncio
+import os
+import pathlib
+import sqlite3
+from bisect import bisect_right
+from ipaddress import IPv4Address, IPv4Network, IPv6Address, IPv6Network, ip_address, ip_network
 from datetime import date, datetime, timedelta, UTC
-from typing import Any, List, Self
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, Iterable, List, Optional, Self, Tuple
 
 def adapt_datetime_iso(val: datetime) -> str:
     """Adapt datetime.datetime to timezone-naive ISO 8601 date."""
@@ -9,6 +14,88 @@ def adapt_datetime_iso(val: datetime) -> str:
 
 aiosqlite.register_adapter(datetime, adapt_datetime_iso)
 
+def parse_ip_network(text: str) -> IPv4Network | IPv6Network:
+    """Parse ban input: an IP address, a CIDR prefix, or a ZeroTier physical address of the form ip/port."""
+    text = text.strip()
+    try:
+        return ip_network(text, strict=False)
+    except ValueError:
+        address, _, port = text.rpartition('/')
+        if not address or not port.isdigit():
+            raise
+        return ip_network(address)
+
+def parse_physical_address(text: str) -> IPv4Address | IPv6Address:
+    """Parse a ZeroTier physical address, which is a plain IP address optionally followed by /port."""
+    text = text.strip()
+    if '/' in text:
+        text, _, port = text.rpartition('/')
+        if not port.isdigit():
+            raise ValueError(f'Invalid port in physical address: {port}')
+    return ip_address(text)
+
+def format_ip_network(network: IPv4Network | IPv6Network) -> str:
+    """Format a network as a plain address when it covers a single host, or as a CIDR prefix otherwise."""
+    if network.prefixlen == network.max_prefixlen:
+        return str(network.network_address)
+    return str(network)
+
+def ip_key(address: IPv4Address | IPv6Address) -> int:
+    """Encode an address as an integer, mapping IPv4 into ::ffff:0:0/96 so both families share one keyspace."""
+    if address.version == 4:
+        return int(address) + 0xffff00000000
+    return int(address)
+
+def ip_range(network: IPv4Network | IPv6Network) -> Tuple[int, int]:
+    """Encode a network as an inclusive range of integers in the same keyspace as ip_key."""
+    return ip_key(network.network_address), ip_key(network.broadcast_address)
+
+def parse_ban_list(text: str) -> Tuple[List[str], List[int]]:
+    """Parse a ban list with one address or prefix per line, anything after a '#' is a comment.
+    Returns the entries along with the line number each one came from."""
+    addresses = []
+    lineNumbers = []
+    for lineNumber, line in enumerate(text.splitlines(), 1):
+        line = line.split('#', 1)[0].strip()
+        if line:
+            addresses.append(line.split()[0])
+            lineNumbers.append(lineNumber)
+    return addresses, lineNumbers
+
+def format_line_numbers(lineNumbers: List[int], limit: int = 50) -> str:
+    """Summarize rejected lines by number only, ban lists are untrusted input and may contain secrets."""
+    text = ', '.join(str(n) for n in lineNumbers[:limit])
+    if len(lineNumbers) > limit:
+        text += f' and {len(lineNumbers) - limit} more'
+    return f'Skipped {len(lineNumbers)} invalid entries on lines {text}'
+
+def format_player_sighting(sighting: Dict[str, Any]) -> List[str]:
+    """Format a row from BotDatabase.iter_player_sightings as lines of text."""
+    lines = []
+    if sighting['game']: lines.append(f"[{sighting['timestamp']}] Player {sighting['player']} spotted in game {sighting['game']}")
+    if sighting['member_id']: lines.append(f"[{sighting['timestamp']}] Member {sighting['member_id']} spotted playing {sighting['player']}")
+    return lines
+
+def format_game_sighting(sighting: Dict[str, Any]) -> List[str]:
+    """Format a row from BotDatabase.iter_game_sightings as lines of text."""
+    return [f"[{sighting['timestamp']}] Player {sighting['player']} spotted in game {sighting['game']}"]
+
+def format_zt_member(member: Dict[str, Any], seenLabel: str) -> str:
+    """Format a ZeroTier member row as text."""
+    if member['physical_address'] != '':
+        return f"[{member['member_id']}] ({member['status']}) {member['physical_address']}, {seenLabel}: {member['last_seen']}"
+    return f"[{member['member_id']}] ({member['status']}) {seenLabel}: {member['last_seen']}"
+
+def format_ban(ban: Dict[str, Any]) -> str:
+    """Format a row from BotDatabase.iter_bans as text."""
+    return f"{ban['address']} expires {ban['expiration']}"
+
+def range_contains(ranges: Tuple[List[int], List[int]], key: int) -> bool:
+    """Check whether key falls in any of the merged, sorted ranges."""
+    starts, ends = ranges
+    i = bisect_right(starts, key) - 1
+    return i >= 0 and key <= ends[i]
+
 table_definitions = [
 """\
 CREATE TABLE IF NOT EXISTS MemberSighting
@@ -73,64 +160,333 @@ CREATE TABLE IF NOT EXISTS IPBan
 """
 ]
 
+ban_range_definitions = [
+"""\
+ALTER TABLE IPBan ADD COLUMN RangeStart BLOB
+""",
+"""\
+ALTER TABLE IPBan ADD COLUMN RangeEnd BLOB
+""",
+"""\
+CREATE INDEX IF NOT EXISTS IX_IPBan_Range
+ON IPBan(RangeStart, RangeEnd)
+"""
+]
+
+game_state_definitions = [
+"""\
+CREATE TABLE IF NOT EXISTS KnownGame
+(
+    GameKey TEXT PRIMARY KEY,
+    Game TEXT,
+    FirstSeen REAL,
+    LastSeen REAL
+)
+""",
+"""\
+CREATE TABLE IF NOT EXISTS ChannelMessage
+(
+    MessageID INTEGER PRIMARY KEY,
+    ChannelID INTEGER,
+    GameKey TEXT,
+    EndedText TEXT
+)
+"""
+]
+
+activity_definitions = [
+"""\
+CREATE TABLE IF NOT EXISTS GameSession
+(
+    GameType TEXT,
+    Version TEXT,
+    Difficulty INTEGER,
+    Started DATETIME,
+    Ended DATETIME,
+    Duration INTEGER,
+    PlayerCount INTEGER
+)
+""",
+"""\
+CREATE TABLE IF NOT EXISTS HourlyActivity
+(
+    Hour DATETIME PRIMARY KEY,
+    Sessions INTEGER,
+    Players INTEGER,
+    Duration INTEGER,
+    PeakGames INTEGER
+)
+""",
+"""\
+CREATE TABLE IF NOT EXISTS DailyActivity
+(
+    Day DATE PRIMARY KEY,
+    Sessions INTEGER,
+    Players INTEGER,
+    Duration INTEGER,
+    PeakGames INTEGER
+)
+""",
+"""\
+CREATE TABLE IF NOT EXISTS DailyGameTypeActivity
+(
+    Day DATE,
+    GameType TEXT,
+    Sessions INTEGER,
+    Duration INTEGER,
+    PRIMARY KEY(Day, GameType)
+)
+"""
+]
+
+name_dictionary_definitions = [
+"""\
+CREATE TABLE IF NOT EXISTS Player
+(
+    ID INTEGER PRIMARY KEY,
+    Name TEXT NOT NULL UNIQUE
+)
+""",
+"""\
+CREATE INDEX IF NOT EXISTS IX_Player_Search
+ON Player(Name COLLATE NOCASE)
+""",
+"""\
+CREATE TABLE IF NOT EXISTS Game
+(
+    ID INTEGER PRIMARY KEY,
+    Name TEXT NOT NULL UNIQUE
+)
+""",
+"""\
+CREATE INDEX IF NOT EXISTS IX_Game_Search
+ON Game(Name COLLATE NOCASE)
+""",
+"""\
+INSERT OR IGNORE INTO Player(Name)
+SELECT PlayerName FROM MemberSighting WHERE PlayerName IS NOT NULL
+UNION
+SELECT PlayerName FROM PlayerSighting WHERE PlayerName IS NOT NULL
+""",
+"""\
+INSERT OR IGNORE INTO Game(Name)
+SELECT GameName FROM PlayerSighting WHERE GameName IS NOT NULL
+""",
+"""\
+DROP INDEX IF EXISTS IX_MemberSighting_Search
+""",
+"""\
+DROP INDEX IF EXISTS IX_PlayerSighting_SearchFirst
+""",
+"""\
+DROP INDEX IF EXISTS IX_PlayerSighting_SearchLast
+""",
+"""\
+DROP INDEX IF EXISTS IX_PlayerSighting_GameSearchFirst
+""",
+"""\
+DROP INDEX IF EXISTS IX_PlayerSighting_GameSearchLast
+""",
+"""\
+ALTER TABLE MemberSighting RENAME TO MemberSightingByName
+""",
+"""\
+CREATE TABLE MemberSighting
+(
+    ZeroTierMemberID TEXT,
+    PlayerID INTEGER,
+    Timestamp DATETIME
+)
+""",
+"""\
+INSERT INTO MemberSighting
+SELECT ZeroTierMemberID, Player.ID, Timestamp
+FROM MemberSightingByName JOIN Player ON Player.Name = MemberSightingByName.PlayerName
+""",
+"""\
+DROP TABLE MemberSightingByName
+""",
+"""\
+ALTER TABLE PlayerSighting RENAME TO PlayerSightingByName
+""",
+"""\
+CREATE TABLE PlayerSighting
+(
+    PlayerID INTEGER,
+    GameID INTEGER,
+    First DATETIME,
+    Last DATETIME
+)
+""",
+"""\
+INSERT INTO PlayerSighting
+SELECT Player.ID, Game.ID, First, Last
+FROM
+    PlayerSightingByName JOIN
+    Player ON Player.Name = PlayerSightingByName.PlayerName JOIN
+    Game ON Game.Name = PlayerSightingByName.GameName
+""",
+"""\
+DROP TABLE PlayerSightingByName
+""",
+"""\
+CREATE INDEX IX_MemberSighting_Search
+ON MemberSighting(PlayerID, Timestamp DESC)
+""",
+"""\
+CREATE INDEX IX_PlayerSighting_SearchFirst
+ON PlayerSighting(PlayerID, First DESC)
+""",
+"""\
+CREATE INDEX IX_PlayerSighting_SearchLast
+ON PlayerSighting(PlayerID, Last DESC)
+""",
+"""\
+CREATE INDEX IX_PlayerSighting_GameSearchFirst
+ON PlayerSighting(GameID, First DESC)
+""",
+"""\
+CREATE INDEX IX_PlayerSighting_GameSearchLast
+ON PlayerSighting(GameID, Last DESC)
+"""
+]
+
+# AUTOINCREMENT keeps the ids of pruned names from being handed out again, a connection that still
+#  has a pruned id cached must never attribute sightings to a different name
+name_id_definitions = [
+"""\
+CREATE TABLE PlayerByID
+(
+    ID INTEGER PRIMARY KEY AUTOINCREMENT,
+    Name TEXT NOT NULL UNIQUE
+)
+""",
+"""\
+INSERT INTO PlayerByID SELECT ID, Name FROM Player
+""",
+"""\
+DROP TABLE Player
+""",
+"""\
+ALTER TABLE PlayerByID RENAME TO Player
+""",
+"""\
+CREATE INDEX IX_Player_Search
+ON Player(Name COLLATE NOCASE)
+""",
+"""\
+CREATE TABLE GameByID
+(
+    ID INTEGER PRIMARY KEY AUTOINCREMENT,
+    Name TEXT NOT NULL UNIQUE
+)
+""",
+"""\
+INSERT INTO GameByID SELECT ID, Name FROM Game
+""",
+"""\
+DROP TABLE Game
+""",
+"""\
+ALTER TABLE GameByID RENAME TO Game
+""",
+"""\
+CREATE INDEX IX_Game_Search
+ON Game(Name COLLATE NOCASE)
+"""
+]
+
+setting_definitions = [
+"""\
+CREATE TABLE IF NOT EXISTS BotSetting
+(
+    Name TEXT PRIMARY KEY,
+    Value TEXT
+)
+"""
+]
+
 class BotDatabase:
-    def __init__(self, dbPath: str = './bot_data.db') -> None:
+    def __init__(self, dbPath: str = './bot_data.db', readOnly: bool = False) -> None:
         self._dbPath = dbPath
+        self._readOnly = readOnly
+        self._banRanges: Optional[Tuple[List[int], List[int]]] = None
+        self._banRangesVersion: Optional[int] = None
+        self._peakGames: Tuple[Optional[datetime], int] = (None, 0)
+        # Player and game names are interned in the Player and Game tables, cache their IDs to skip the lookups
+        self._playerIds: Dict[str, int] = {}
+        self._gameIds: Dict[str, int] = {}
+        # Held from interning a name until the sighting referencing it is written, so pruning can't remove it in between
+        self._internLock = asyncio.Lock()
+        self._namesVersion: Optional[int] = None
 
-    async def find_player_by_name(self, name: str) -> List[str]:
+    async def iter_player_sightings(self, name: str) -> AsyncGenerator[Dict[str, Any], None]:
         query = '\n'.join((
-            "SELECT Timestamp, GameName, ZeroTierMemberID",
+            "WITH Players AS",
+            "(",
+            "    SELECT ID, Name",
+            "    FROM Player",
+            "    WHERE Name = ? COLLATE NOCASE",
+            ")",
+            "SELECT Timestamp, Players.Name, GameName, ZeroTierMemberID",
             "FROM",
             "(",
-            "    SELECT Timestamp, PlayerName, NULL GameName, ZeroTierMemberID",
+            "    SELECT Timestamp, PlayerID, NULL GameName, ZeroTierMemberID",
             "    FROM MemberSighting",
+            "    WHERE PlayerID IN (SELECT ID FROM Players)",
             "    UNION",
-            "    SELECT First Timestamp, PlayerName, GameName, NULL ZeroTierMemberID",
-            "    FROM PlayerSighting",
+            "    SELECT First Timestamp, PlayerID, Game.Name GameName, NULL ZeroTierMemberID",
+            "    FROM PlayerSighting JOIN Game ON Game.ID = PlayerSighting.GameID",
+            "    WHERE PlayerID IN (SELECT ID FROM Players)",
             "    UNION",
-            "    SELECT Last Timestamp, PlayerName, GameName, NULL ZeroTierMemberID",
-            "    FROM PlayerSighting",
-            ") Sighting",
-            "WHERE PlayerName = ? COLLATE NOCASE",
+            "    SELECT Last Timestamp, PlayerID, Game.Name GameName, NULL ZeroTierMemberID",
+            "    FROM PlayerSighting JOIN Game ON Game.ID = PlayerSighting.GameID",
+            "    WHERE PlayerID IN (SELECT ID FROM Players)",
+            ") Sighting JOIN Players ON Players.ID = Sighting.PlayerID",
             "ORDER BY Timestamp DESC",
             "LIMIT 50",
         ))
 
-        sightings = []
         async with self._db.execute(query, (name,)) as cursor:
             async for row in cursor:
-                timestamp = row[0]
-                gameName = row[1]
-                ztid = row[2]
-                if gameName: sightings.append(f'[{timestamp}] Player {name} spotted in game {gameName}')
-                if ztid: sightings.append(f'[{timestamp}] Member {ztid} spotted playing {name}')
-        return sightings
+                yield {'timestamp': row[0], 'player': row[1], 'game': row[2], 'member_id': row[3]}
 
-    async def find_game_by_name(self, name: str) -> List[str]:
+    async def find_player_by_name(self, name: str) -> List[str]:
+        return [line async for sighting in self.iter_player_sightings(name) for line in format_player_sighting(sighting)]
+
+    async def iter_game_sightings(self, name: str) -> AsyncGenerator[Dict[str, Any], None]:
         query = '\n'.join((
-            "SELECT Timestamp, PlayerName",
+            "WITH Games AS",
+            "(",
+            "    SELECT ID, Name",
+            "    FROM Game",
+            "    WHERE Name = ? COLLATE NOCASE",
+            ")",
+            "SELECT Timestamp, Player.Name, Games.Name",
             "FROM",
             "(",
-            "    SELECT First Timestamp, PlayerName, GameName",
+            "    SELECT First Timestamp, PlayerID, GameID",
             "    FROM PlayerSighting",
+            "    WHERE GameID IN (SELECT ID FROM Games)",
             "    UNION",
-            "    SELECT Last Timestamp, PlayerName, GameName",
+            "    SELECT Last Timestamp, PlayerID, GameID",
             "    FROM PlayerSighting",
+            "    WHERE GameID IN (SELECT ID FROM Games)",
             ") Sighting",
-            "WHERE GameName = ? COLLATE NOCASE",
+            "JOIN Player ON Player.ID = Sighting.PlayerID",
+            "JOIN Games ON Games.ID = Sighting.GameID",
             "ORDER BY Timestamp DESC",
             "LIMIT 50",
         ))
 
-        sightings = []
         async with self._db.execute(query, (name,)) as cursor:
             async for row in cursor:
-                timestamp = row[0]
-                playerName = row[1]
-                sightings.append(f'[{timestamp}] Player {playerName} spotted in game {name}')
-        return sightings
+                yield {'timestamp': row[0], 'player': row[1], 'game': row[2]}
 
-    async def find_zt_member_by_id(self, ztid: str) -> str:
+    async def find_game_by_name(self, name: str) -> List[str]:
+        return [line async for sighting in self.iter_game_sightings(name) for line in format_game_sighting(sighting)]
+
+    async def get_zt_member(self, ztid: str) -> Optional[Dict[str, Any]]:
         query = '\n'.join((
             "SELECT",
             "    ID,",
@@ -144,17 +500,16 @@ class BotDatabase:
         async with self._db.execute(query, (ztid,)) as cursor:
             row = await cursor.fetchone()
             if not row:
-                return ''
-            id = row[0]
-            ip = row[1]
-            lastSeen = row[2]
-            status = row[3]
-            if ip != '':
-                return f'[{id}] ({status}) {ip}, Seen: {lastSeen}'
-            else:
-                return f'[{id}] ({status}) Seen: {lastSeen}'
+                return None
+            return {'member_id': row[0], 'physical_address': row[1], 'last_seen': row[2], 'status': row[3]}
 
-    async def list_zt_members(self) -> List[str]:
+    async def find_zt_member_by_id(self, ztid: str) -> str:
+        member = await self.get_zt_member(ztid)
+        if not member:
+            return ''
+        return format_zt_member(member, 'Seen')
+
+    async def iter_zt_members(self) -> AsyncGenerator[Dict[str, Any], None]:
         query = '\n'.join((
             "SELECT",
             "    ID,",
@@ -166,38 +521,73 @@ class BotDatabase:
             "LIMIT 50",
         ))
 
-        members = []
         async with self._db.execute(query) as cursor:
             async for row in cursor:
-                id = row[0]
-                ip = row[1]
-                lastSeen = row[2]
-                status = row[3]
-                if ip != '':
-                    members.append(f'[{id}] ({status}) {ip}, Last seen: {lastSeen}')
-                else:
-                    members.append(f'[{id}] ({status}) Last seen: {lastSeen}')
-        return members
+                yield {'member_id': row[0], 'physical_address': row[1], 'last_seen': row[2], 'status': row[3]}
+
+    async def list_zt_members(self) -> List[str]:
+        return [format_zt_member(member, 'Last seen') async for member in self.iter_zt_members()]
 
     async def find_members_to_block(self) -> List[str]:
-        # Limit query to 15 members to avoid ZeroTier rate limit of 20 requests per second
+        banRanges = await self._load_ban_ranges()
+        if not banRanges[0]:
+            return []
+
         query = '\n'.join((
-            "SELECT ZeroTierMember.ID",
-            "FROM",
-            "    IPBan JOIN",
-            "    ZeroTierMember ON IPBan.IPAddress = ZeroTierMember.PhysicalAddress",
-            "WHERE ZeroTierMember.Status <> 'blocked'",
-            "ORDER BY ZeroTierMember.LastSeen DESC",
-            "LIMIT 15",
+            "SELECT ID, PhysicalAddress",
+            "FROM ZeroTierMember",
+            "WHERE",
+            "    Status <> 'blocked' AND",
+            "    PhysicalAddress <> ''",
+            "ORDER BY LastSeen DESC",
         ))
 
         memberIds = []
         async with self._db.execute(query) as cursor:
             async for row in cursor:
-                memberIds.append(row[0])
+                try:
+                    key = ip_key(parse_physical_address(row[1]))
+                except ValueError:
+                    continue
+                if range_contains(banRanges, key):
+                    memberIds.append(row[0])
+                    # Limit to 15 members to avoid ZeroTier rate limit of 20 requests per second
+                    if len(memberIds) == 15:
+                        break
         return memberIds
 
-    async def list_bans(self) -> List[str]:
+    async def _load_ban_ranges(self) -> Tuple[List[int], List[int]]:
+        # data_version only changes when another connection commits, e.g. bans added with the admin tool
+        async with self._db.execute("PRAGMA data_version") as cursor:
+            row = await cursor.fetchone()
+            dataVersion = row[0] if row else None
+        if self._banRanges is not None and dataVersion == self._banRangesVersion:
+            return self._banRanges
+        self._banRangesVersion = dataVersion
+
+        query = '\n'.join((
+            "SELECT RangeStart, RangeEnd",
+            "FROM IPBan",
+            "WHERE RangeStart IS NOT NULL",
+            "ORDER BY RangeStart",
+        ))
+
+        # Merge overlapping ranges so a single bisect answers membership
+        starts: List[int] = []
+        ends: List[int] = []
+        async with self._db.execute(query) as cursor:
+            async for row in cursor:
+                start = int.from_bytes(row[0], 'big')
+                end = int.from_bytes(row[1], 'big')
+                if ends and start <= ends[-1] + 1:
+                    ends[-1] = max(ends[-1], end)
+                else:
+                    starts.append(start)
+                    ends.append(end)
+        self._banRanges = (starts, ends)
+        return self._banRanges
+
+    async def iter_bans(self) -> AsyncGenerator[Dict[str, Any], None]:
         query = '\n'.join((
             "SELECT",
             "    IPAddress,",
@@ -207,20 +597,42 @@ class BotDatabase:
             "LIMIT 50",
         ))
 
-        bans = []
         async with self._db.execute(query) as cursor:
             async for row in cursor:
-                ip = row[0]
-                expiration = row[1]
-                bans.append(f'{ip} expires {expiration}')
-        return bans
+                yield {'address': row[0], 'expiration': row[1]}
+
+    async def list_bans(self) -> List[str]:
+        return [format_ban(ban) async for ban in self.iter_bans()]
+
+    async def _check_name_caches(self, cursor: aiosqlite.Cursor) -> None:
+        # Another connection may have pruned names, e.g. the admin tool, so cached ids can't be trusted after it commits
+        await cursor.execute("PRAGMA data_version")
+        row = await cursor.fetchone()
+        dataVersion = row[0] if row else None
+        if dataVersion != self._namesVersion:
+            self._playerIds.clear()
+            self._gameIds.clear()
+            self._namesVersion = dataVersion
+
+    async def _intern(self, cursor: aiosqlite.Cursor, table: str, cache: Dict[str, int], name: str) -> int:
+        id = cache.get(name)
+        if id is not None:
+            return id
+
+        await cursor.execute(f"INSERT OR IGNORE INTO {table}(Name) VALUES(?)", (name,))
+        await cursor.execute(f"SELECT ID FROM {table} WHERE Name = ?", (name,))
+        row = await cursor.fetchone()
+        assert row is not None
+        id = int(row[0])
+        cache[name] = id
+        return id
 
     async def save_member_sighting(self, ipv6: IPv6Address, playerName: str, at: datetime) -> None:
         query = '\n'.join((
             "INSERT INTO MemberSighting",
             "SELECT",
             "    :memberId ZeroTierMemberID,",
-            "    :playerName PlayerName,",
+            "    :playerId PlayerID,",
             "    :at Timestamp",
             "WHERE NOT EXISTS",
             "(",
@@ -228,18 +640,18 @@ class BotDatabase:
             "    FROM MemberSighting",
             "    WHERE",
             "        ZeroTierMemberID = :memberId AND",
-            "        PlayerName = :playerName AND",
+            "        PlayerID = :playerId AND",
             "        Timestamp = :at",
             ")",
         ))
 
-        queryParameters = {
-            'memberId': ipv6.packed[-5:].hex(),
-            'playerName': playerName,
-            'at': at
-        }
-
-        async with self._db.cursor() as cursor:
+        async with self._internLock, self._db.cursor() as cursor:
+            await self._check_name_caches(cursor)
+            queryParameters = {
+                'memberId': ipv6.packed[-5:].hex(),
+                'playerId': await self._intern(cursor, 'Player', self._playerIds, playerName),
+                'at': at
+            }
             await cursor.execute(query, queryParameters)
         await self._db.commit()
 
@@ -255,17 +667,20 @@ class BotDatabase:
             "        FROM PlayerSighting Next",
             "        WHERE",
             "            Last > PlayerSighting.Last AND",
-            "            PlayerName = PlayerSighting.PlayerName AND",
-            "            GameName = PlayerSighting.GameName",
+            "            PlayerID = PlayerSighting.PlayerID AND",
+            "            GameID = PlayerSighting.GameID",
             "    ) AND",
-            "    PlayerName = ? AND",
-            "    GameName = ?",
+            "    PlayerID = ? AND",
+            "    GameID = ?",
         ))
 
-        async with self._db.cursor() as cursor:
-            await cursor.execute(updateQuery, (at, playerName, gameName))
+        async with self._internLock, self._db.cursor() as cursor:
+            await self._check_name_caches(cursor)
+            playerId = await self._intern(cursor, 'Player', self._playerIds, playerName)
+            gameId = await self._intern(cursor, 'Game', self._gameIds, gameName)
+            await cursor.execute(updateQuery, (at, playerId, gameId))
             if cursor.rowcount == 0:
-                await cursor.execute("INSERT INTO PlayerSighting VALUES(?, ?, ?, ?)", (playerName, gameName, at, at))
+                await cursor.execute("INSERT INTO PlayerSighting VALUES(?, ?, ?, ?)", (playerId, gameId, at, at))
         await self._db.commit()
 
     async def save_zt_member(self, id: str, physicalAddress: str, lastSeen: datetime, status: str) -> None:
@@ -293,15 +708,87 @@ class BotDatabase:
             await cursor.execute(query, queryParameters)
         await self._db.commit()
 
-    async def ban(self, physicalAddress: str) -> None:
+    async def ban(self, physicalAddress: str) -> str:
+        network = parse_ip_network(physicalAddress)
+        address = format_ip_network(network)
+        start, end = ip_range(network)
         expiration = datetime.now(UTC) + timedelta(days=30)
+        queryParameters = (address, expiration, start.to_bytes(16, 'big'), end.to_bytes(16, 'big'))
         async with self._db.cursor() as cursor:
-            await cursor.execute("INSERT OR REPLACE INTO IPBan VALUES(?, ?)", (physicalAddress, expiration))
+            await cursor.execute("INSERT OR REPLACE INTO IPBan VALUES(?, ?, ?, ?)", queryParameters)
         await self._db.commit()
+        self._banRanges = None
+        return address
+
+    async def ban_many(self, physicalAddresses: Iterable[str]) -> Tuple[int, List[int]]:
+        expiration = datetime.now(UTC) + timedelta(days=30)
+        rows = {}
+        invalid = []
+        for i, physicalAddress in enumerate(physicalAddresses):
+            try:
+                network = parse_ip_network(physicalAddress)
+            except ValueError:
+                invalid.append(i)
+                continue
+            start, end = ip_range(network)
+            rows[format_ip_network(network)] = (expiration, start.to_bytes(16, 'big'), end.to_bytes(16, 'big'))
 
-    async def remove_ban(self, physicalAddress: str) -> None:
+        queryParameters = [(address, *row) for address, row in rows.items()]
         async with self._db.cursor() as cursor:
-            await cursor.execute("DELETE FROM IPBan WHERE IPAddress = ?", (physicalAddress,))
+            await cursor.executemany("INSERT OR REPLACE INTO IPBan VALUES(?, ?, ?, ?)", queryParameters)
+        await self._db.commit()
+        self._banRanges = None
+        return len(queryParameters), invalid
+
+    async def export_bans(self) -> List[str]:
+        query = '\n'.join((
+            "SELECT IPAddress",
+            "FROM IPBan",
+            "ORDER BY RangeStart, IPAddress",
+        ))
+
+        async with self._db.execute(query) as cursor:
+            return [row[0] for row in await cursor.fetchall()]
+
+    async def remove_ban(self, physicalAddress: str) -> Tuple[str, bool]:
+        try:
+            address = format_ip_network(parse_ip_network(physicalAddress))
+        except ValueError:
+            address = physicalAddress
+        async with self._db.cursor() as cursor:
+            await cursor.execute("DELETE FROM IPBan WHERE IPAddress = ?", (address,))
+            removed = cursor.rowcount > 0
+        await self._db.commit()
+        self._banRanges = None
+        return address, removed
+
+    async def load_known_games(self) -> List[Tuple[str, str, float, float]]:
+        query = '\n'.join((
+            "SELECT GameKey, Game, FirstSeen, LastSeen",
+            "FROM KnownGame",
+            "ORDER BY FirstSeen",
+        ))
+
+        async with self._db.execute(query) as cursor:
+            return [(row[0], row[1], row[2], row[3]) for row in await cursor.fetchall()]
+
+    async def load_channel_messages(self, channelId: int) -> List[Tuple[int, Optional[str], Optional[str]]]:
+        query = '\n'.join((
+            "SELECT MessageID, GameKey, EndedText",
+            "FROM ChannelMessage",
+            "WHERE ChannelID = ?",
+            "ORDER BY MessageID",
+        ))
+
+        async with self._db.execute(query, (channelId,)) as cursor:
+            return [(row[0], row[1], row[2]) for row in await cursor.fetchall()]
+
+    async def save_game_state(self, games: List[Tuple[str, str, float, float]], messages: List[Tuple[int, int, Optional[str], Optional[str]]]) -> None:
+        async with self._db.cursor() as cursor:
+            await cursor.execute("DELETE FROM KnownGame")
+            await cursor.executemany("INSERT INTO KnownGame VALUES(?, ?, ?, ?)", games)
+            await cursor.execute("DELETE FROM ChannelMessage")
+            await cursor.executemany("INSERT INTO ChannelMessage VALUES(?, ?, ?, ?)", messages)
         await self._db.commit()
 
     async def clean_up(self) -> None:
@@ -313,15 +800,313 @@ class BotDatabase:
             await cursor.execute("DELETE FROM PlayerSighting WHERE Last < ?", (sightingThreshold,))
             await cursor.execute("DELETE FROM ZeroTierMember WHERE LastSeen < ?", (memberThreshold,))
             await cursor.execute("DELETE FROM IPBan WHERE Expiration < ?", (now,))
+            if cursor.rowcount > 0:
+                self._banRanges = None
         await self._db.commit()
 
-    async def __aenter__(self) -> Self:
-        self._db = await aiosqlite.connect(self._dbPath)
+    async def prune_names(self) -> None:
+        # Scans every name, so this runs on a much slower schedule than clean_up
+        playerQuery = '\n'.join((
+            "DELETE FROM Player",
+            "WHERE",
+            "    NOT EXISTS (SELECT * FROM MemberSighting WHERE PlayerID = Player.ID) AND",
+            "    NOT EXISTS (SELECT * FROM PlayerSighting WHERE PlayerID = Player.ID)",
+        ))
+
+        gameQuery = '\n'.join((
+            "DELETE FROM Game",
+            "WHERE NOT EXISTS (SELECT * FROM PlayerSighting WHERE GameID = Game.ID)",
+        ))
+
+        async with self._internLock, self._db.cursor() as cursor:
+            await cursor.execute(playerQuery)
+            await cursor.execute(gameQuery)
+            # Cached ids may now point at deleted rows, and the caches would otherwise only ever grow
+            self._playerIds.clear()
+            self._gameIds.clear()
+        await self._db.commit()
+
+    async def activity_stats(self, days: int) -> List[str]:
+        since = (datetime.now(UTC) - timedelta(days=days)).date().isoformat()
+        stats: List[str] = []
+
+        query = '\n'.join((
+            "SELECT",
+            "    SUM(Sessions),",
+            "    SUM(Players),",
+            "    SUM(Duration),",
+            "    MAX(PeakGames)",
+            "FROM DailyActivity",
+            "WHERE Day >= ?",
+        ))
+
+        async with self._db.execute(query, (since,)) as cursor:
+            row = await cursor.fetchone()
+            if not row or not row[0]:
+                return stats
+            sessions = row[0]
+            players = row[1]
+            minutes = round(row[2] / sessions / 60)
+            stats.append(f'Last {days} days: {sessions} games, {players} players, average length {minutes} minutes')
+
+        query = '\n'.join((
+            "SELECT Hour, PeakGames",
+            "FROM HourlyActivity",
+            "WHERE Hour >= ?",
+            "ORDER BY PeakGames DESC, Hour DESC",
+            "LIMIT 1",
+        ))
+
+        async with self._db.execute(query, (since,)) as cursor:
+            row = await cursor.fetchone()
+            if row and row[1]:
+                stats.append(f'Peak concurrent games: {row[1]} ({row[0]})')
+
+        query = '\n'.join((
+            "SELECT Day, Sessions",
+            "FROM DailyActivity",
+            "WHERE Day >= ?",
+            "ORDER BY Sessions DESC, Day DESC",
+            "LIMIT 1",
+        ))
+
+        async with self._db.execute(query, (since,)) as cursor:
+            row = await cursor.fetchone()
+            if row and row[1]:
+                stats.append(f'Busiest day: {row[0]} ({row[1]} games)')
+
+        query = '\n'.join((
+            "SELECT GameType, SUM(Sessions) Sessions",
+            "FROM DailyGameTypeActivity",
+            "WHERE Day >= ?",
+            "GROUP BY GameType",
+            "ORDER BY Sessions DESC",
+            "LIMIT 5",
+        ))
+
+        async with self._db.execute(query, (since,)) as cursor:
+            gameTypes = [f'{row[0]} ({row[1]})' async for row in cursor]
+            if gameTypes:
+                stats.append('Most popular game types: ' + ', '.join(gameTypes))
+
+        return stats
+
+    async def archive_sessions(self, sessions: List[Tuple[str, str, int, datetime, datetime, int, int]]) -> None:
+        sessionQuery = "INSERT INTO GameSession VALUES(?, ?, ?, ?, ?, ?, ?)"
+
+        hourlyQuery = '\n'.join((
+            "INSERT INTO HourlyActivity VALUES(?, 1, ?, ?, 0)",
+            "ON CONFLICT DO UPDATE SET",
+            "    Sessions = Sessions + 1,",
+            "    Players = Players + excluded.Players,",
+            "    Duration = Duration + excluded.Duration",
+        ))
+
+        dailyQuery = '\n'.join((
+            "INSERT INTO DailyActivity VALUES(?, 1, ?, ?, 0)",
+            "ON CONFLICT DO UPDATE SET",
+            "    Sessions = Sessions + 1,",
+            "    Players = Players + excluded.Players,",
+            "    Duration = Duration + excluded.Duration",
+        ))
+
+        gameTypeQuery = '\n'.join((
+            "INSERT INTO DailyGameTypeActivity VALUES(?, ?, 1, ?)",
+            "ON CONFLICT DO UPDATE SET",
+            "    Sessions = Sessions + 1,",
+            "    Duration = Duration + excluded.Duration",
+        ))
+
+        # Rollups are bucketed by the time the session ended
+        hourly = []
+        daily = []
+        gameTypes = []
+        for gameType, _, _, _, ended, duration, playerCount in sessions:
+            hour = ended.replace(minute=0, second=0, microsecond=0)
+            day = ended.date().isoformat()
+            hourly.append((hour, playerCount, duration))
+            daily.append((day, playerCount, duration))
+            gameTypes.append((day, gameType, duration))
+
+        async with self._db.cursor() as cursor:
+            await cursor.executemany(sessionQuery, sessions)
+            await cursor.executemany(hourlyQuery, hourly)
+            await cursor.executemany(dailyQuery, daily)
+            await cursor.executemany(gameTypeQuery, gameTypes)
+        await self._db.commit()
+
+    async def record_concurrent_games(self, at: datetime, count: int) -> None:
+        # Only write when the peak for the current hour is exceeded
+        hour = at.replace(minute=0, second=0, microsecond=0)
+        peakHour, peakGames = self._peakGames
+        if hour == peakHour and count <= peakGames:
+            return
+        self._peakGames = (hour, count)
+
+        hourlyQuery = '\n'.join((
+            "INSERT INTO HourlyActivity VALUES(?, 0, 0, 0, ?)",
+            "ON CONFLICT DO UPDATE SET",
+            "    PeakGames = MAX(PeakGames, excluded.PeakGames)",
+        ))
+
+        dailyQuery = '\n'.join((
+            "INSERT INTO DailyActivity VALUES(?, 0, 0, 0, ?)",
+            "ON CONFLICT DO UPDATE SET",
+            "    PeakGames = MAX(PeakGames, excluded.PeakGames)",
+        ))
+
+        async with self._db.cursor() as cursor:
+            await cursor.execute(hourlyQuery, (hour, count))
+            await cursor.execute(dailyQuery, (at.date().isoformat(), count))
+        await self._db.commit()
+
+    async def get_setting(self, name: str) -> Optional[str]:
+        async with self._db.execute("SELECT Value FROM BotSetting WHERE Name = ?", (name,)) as cursor:
+            row = await cursor.fetchone()
+            return row[0] if row else None
+
+    async def set_setting(self, name: str, value: str) -> None:
         async with self._db.cursor() as cursor:
-            for table_definition in table_definitions:
-                await cursor.execute(table_definition)
+            await cursor.execute("INSERT OR REPLACE INTO BotSetting VALUES(?, ?)", (name, value))
         await self._db.commit()
+
+    async def backup(self, targetPath: str, keep: int = 3) -> None:
+        # The backup runs on its own read-only connection in a worker thread, so copying never holds up
+        #  queries on the bot's connection
+        await asyncio.to_thread(self._backup, targetPath, keep)
+
+    def _backup(self, targetPath: str, keep: int) -> None:
+        # Copying in steps restarts the backup whenever the bot commits in between. Copying every page in one
+        #  step reads a consistent snapshot in a single read transaction instead, which in WAL mode never blocks
+        #  the bot's writes, they go to the WAL until the copy is done.
+        tempPath = targetPath + '.tmp'
+        source = sqlite3.connect(pathlib.Path(self._dbPath).resolve().as_uri() + '?mode=ro', uri=True)
+        target = sqlite3.connect(tempPath)
+        try:
+            source.backup(target, pages=-1)
+            # Snapshots are standalone files that can be opened read-only without a WAL index
+            target.execute("PRAGMA journal_mode=DELETE")
+        finally:
+            target.close()
+            source.close()
+
+        # keep snapshots in total: the newest at targetPath, older ones at targetPath.1 up to targetPath.{keep - 1}
+        for i in range(keep - 1, 0, -1):
+            olderPath = f'{targetPath}.{i - 1}' if i > 1 else targetPath
+            if os.path.exists(olderPath):
+                os.replace(olderPath, f'{targetPath}.{i}')
+        os.replace(tempPath, targetPath)
+
+    async def compact(self) -> None:
+        await self._db.commit()
+        await self._db.execute("VACUUM")
+        await self._db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        await self._db.execute("PRAGMA optimize")
+
+    async def __aenter__(self) -> Self:
+        if self._readOnly:
+            # Read-only connections can't migrate, so refuse to run queries against an older schema
+            self._db = await self._connect(pathlib.Path(self._dbPath).resolve().as_uri() + '?mode=ro', uri=True)
+            if await self._schema_version() < len(self._migrations()):
+                await self._db.close()
+                raise RuntimeError(f'The schema of {self._dbPath} is out of date, open it for writing once to migrate it')
+            return self
+
+        self._db = await self._connect(self._dbPath)
+        # WAL lets backups and offline readers work alongside the bot without blocking its writes
+        await self._db.execute("PRAGMA journal_mode=WAL")
+        await self._migrate()
         return self
 
+    async def _connect(self, database: str, uri: bool = False) -> aiosqlite.Connection:
+        # A failed aiosqlite.connect leaves its worker thread to finish after the event loop may already be closed,
+        #  so open the file once up front to fail before the thread is started
+        sqlite3.connect(database, uri=uri).close()
+        return await aiosqlite.connect(database, uri=uri)
+
+    def _migrations(self) -> List[Callable[[aiosqlite.Cursor], Awaitable[None]]]:
+        # Each migration brings the schema from version N to N + 1, the current version is kept in PRAGMA user_version.
+        #  Databases created before versioning was introduced report version 0, so the first migrations tolerate existing objects.
+        return [
+            self._create_tables,
+            self._add_ban_range_columns,
+            self._create_game_state_tables,
+            self._create_setting_table,
+            self._create_activity_tables,
+            self._create_name_dictionaries,
+            self._autoincrement_name_ids,
+        ]
+
+    async def _schema_version(self) -> int:
+        async with self._db.execute("PRAGMA user_version") as cursor:
+            row = await cursor.fetchone()
+            return int(row[0]) if row else 0
+
+    async def _migrate(self) -> None:
+        migrations = self._migrations()
+        version = await self._schema_version()
+        if version >= len(migrations):
+            return
+
+        async with self._db.cursor() as cursor:
+            for migration in migrations[version:]:
+                await migration(cursor)
+                version += 1
+                await cursor.execute(f"PRAGMA user_version = {version}")
+        await self._db.commit()
+
+    async def _create_tables(self, cursor: aiosqlite.Cursor) -> None:
+        for table_definition in table_definitions:
+            await cursor.execute(table_definition)
+
+    async def _add_ban_range_columns(self, cursor: aiosqlite.Cursor) -> None:
+        await cursor.execute("SELECT name FROM pragma_table_info('IPBan')")
+        columns = [row[0] for row in await cursor.fetchall()]
+        for table_definition in ban_range_definitions:
+            if 'RangeStart' in columns and table_definition.startswith('ALTER'):
+                continue
+            await cursor.execute(table_definition)
+
+        # Bans created before CIDR ranges were supported hold whatever was matched exactly against
+        #  ZeroTierMember.PhysicalAddress, normalize them to the key remove_ban looks up and encode their range.
+        #  Rows that normalize to the same address are merged, keeping the latest expiration.
+        mergeQuery = '\n'.join((
+            "INSERT INTO IPBan VALUES(?, ?, ?, ?)",
+            "ON CONFLICT DO UPDATE SET",
+            "    Expiration = MAX(Expiration, excluded.Expiration),",
+            "    RangeStart = excluded.RangeStart,",
+            "    RangeEnd = excluded.RangeEnd",
+        ))
+
+        await cursor.execute("SELECT IPAddress, Expiration FROM IPBan WHERE RangeStart IS NULL")
+        for ipAddress, expiration in await cursor.fetchall():
+            try:
+                network = ip_network(parse_physical_address(ipAddress))
+            except ValueError:
+                continue
+            start, end = ip_range(network)
+            await cursor.execute("DELETE FROM IPBan WHERE IPAddress = ?", (ipAddress,))
+            await cursor.execute(mergeQuery, (format_ip_network(network), expiration, start.to_bytes(16, 'big'), end.to_bytes(16, 'big')))
+
+    async def _create_game_state_tables(self, cursor: aiosqlite.Cursor) -> None:
+        for table_definition in game_state_definitions:
+            await cursor.execute(table_definition)
+
+    async def _create_setting_table(self, cursor: aiosqlite.Cursor) -> None:
+        for table_definition in setting_definitions:
+            await cursor.execute(table_definition)
+
+    async def _create_activity_tables(self, cursor: aiosqlite.Cursor) -> None:
+        for table_definition in activity_definitions:
+            await cursor.execute(table_definition)
+
+    async def _create_name_dictionaries(self, cursor: aiosqlite.Cursor) -> None:
+        for table_definition in name_dictionary_definitions:
+            await cursor.execute(table_definition)
+
+    async def _autoincrement_name_ids(self, cursor: aiosqlite.Cursor) -> None:
+        for table_definition in name_id_definitions:
+            await cursor.execute(table_definition)
+
     async def __aexit__(self, *exc: Any) -> None:
         await self._db.close()
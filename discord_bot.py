@@ -1,29 +1,42 @@
 import asyncio
 from aiohttp.client_exceptions import ClientConnectorError
-from collections import deque
 import discord
+import gzip
+import hashlib
+import heapq
+import io
 import json
 import logging
 import math
 import pathlib
 import re
 import time
-from bot_db import BotDatabase
-from datetime import datetime, UTC
+from bot_db import BotDatabase, format_line_numbers, parse_ban_list
+from datetime import datetime, timedelta, UTC
 from ipaddress import IPv6Address
 from semver import compare
-from typing import Any, Deque, Dict, Iterator, List, Optional
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 from ztapi_client import ZeroTierApiClient
 
 logger = logging.getLogger(__name__)
 
+PersistBatch = Tuple[List[Dict[str, Any]], List[Dict[str, Any]], List[Tuple[str, str, int, datetime, datetime, int, int]], datetime, int]
+
 ztid: str = 'a84ac5c10a7ebb5f'
 
 config: Dict[str, Any] = {
     'channel': 1061483226767556719,
+    'channels': [],
     'game_ttl': 120,
     'banlist_file': './banlist',
     'gamelist_file': './gamelist.json',
+    'gamelist_files': [],
+    'source_ttl': 60,
+    'persist_queue_size': 60,
+    'backup_file': './bot_data.backup.db',
+    'backup_count': 3,
+    'backup_interval': 21600,
+    'record_file': '',
     'zt_token': '',
     'log_level': 'info'
 }
@@ -121,6 +134,11 @@ def format_game_message(game: Dict[str, Any]) -> str:
     return text
 
 
+def strike_game_message(text: str) -> str:
+    # Marks a game message as ended when only its published text survived, the game data and duration are lost
+    return re.sub(r'^\*\*([^*\n]+)\*\*', r'~~\1~~', text, count=1)
+
+
 def format_status_message(current_online: int) -> str:
     if current_online == 1:
         return 'There is currently **' + str(current_online) + '** public game.'
@@ -181,6 +199,67 @@ def any_player_name_contains_a_banned_word(players: List[str]) -> bool:
     return False
 
 
+def read_snapshot(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        # Load the file as a JSON object
+        with open(path) as file:
+            snapshot: Dict[str, Any] = json.load(file)
+
+        # Delete the file when we're done with it
+        pathlib.Path(path).unlink()
+    except FileNotFoundError:
+        return None
+    return snapshot
+
+
+def record_snapshot(path: str, source: str, snapshot: Dict[str, Any]) -> None:
+    # Every append adds a separate gzip member, gzip readers treat them as one continuous stream
+    with gzip.open(path, 'at', encoding='utf-8') as file:
+        file.write(json.dumps({'timestamp': time.time(), 'source': source, 'snapshot': snapshot}) + '\n')
+
+
+def merge_games(game_lists: Iterable[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    # Games are copied so callers can keep and mutate them without touching the snapshots they came from
+    merged: Dict[str, Dict[str, Any]] = {}
+    for games in game_lists:
+        for game in games:
+            key = game['id'].upper()
+            if key not in merged:
+                merged[key] = dict(game)
+                merged[key]['players'] = list(game['players'])
+                continue
+            players = merged[key]['players']
+            for name in game['players']:
+                if name not in players:
+                    players.append(name)
+    return list(merged.values())
+
+
+def merge_sightings(sighting_lists: Iterable[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    merged: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    for sightings in sighting_lists:
+        for sighting in sightings:
+            merged.setdefault((sighting['address'], sighting['name']), sighting)
+    return list(merged.values())
+
+
+def pop_ended_games(expiry_heap: List[Tuple[float, str]], known_games: Dict[str, Dict[str, Any]], now: float) -> List[str]:
+    # Each known game has exactly one entry in the heap, keyed on the deadline it had when the entry was pushed.
+    #  Games seen again since then are pushed back with their new deadline rather than rescanned every tick.
+    ended_games = []
+    while expiry_heap and expiry_heap[0][0] <= now:
+        _, key = heapq.heappop(expiry_heap)
+        game = known_games.get(key)
+        if game is None:
+            continue
+        deadline = game['last_seen'] + config['game_ttl']
+        if deadline <= now:
+            ended_games.append(key)
+        else:
+            heapq.heappush(expiry_heap, (deadline, key))
+    return ended_games
+
+
 async def apply_ip_bans(network: Any, members: Any, db: BotDatabase, zt: ZeroTierApiClient) -> None:
     memberLookup = {}
     for member in members:
@@ -193,20 +272,18 @@ async def apply_ip_bans(network: Any, members: Any, db: BotDatabase, zt: ZeroTie
         if member: await zt.tag_member(network, member, 'status', 'blocked')
 
 
-async def dump_games(games: Any, db: BotDatabase) -> None:
-    now = datetime.now(UTC)
+async def dump_games(games: Any, db: BotDatabase, at: datetime) -> None:
     for game in games:
         for playerName in game['players']:
             gameName = game['id']
-            await db.save_player_sighting(playerName, gameName, now)
+            await db.save_player_sighting(playerName, gameName, at)
 
 
-async def dump_sightings(sightings: Any, db: BotDatabase) -> None:
-    now = datetime.now(UTC)
+async def dump_sightings(sightings: Any, db: BotDatabase, at: datetime) -> None:
     for sighting in sightings:
         ipv6 = IPv6Address(sighting['address'])
         playerName = sighting['name']
-        await db.save_member_sighting(ipv6, playerName, now)
+        await db.save_member_sighting(ipv6, playerName, at)
 
 
 async def dump_members(network: Any, members: Any, db: BotDatabase) -> None:
@@ -228,13 +305,139 @@ async def dump_members(network: Any, members: Any, db: BotDatabase) -> None:
         await db.save_zt_member(id, physicalAddress, lastSeen, status)
 
 
+class ChannelPublisher:
+    def __init__(self, channel: discord.TextChannel) -> None:
+        self._channel = channel
+        self._active_messages: Dict[str, discord.Message] = {}
+        self._ended_messages: Dict[str, Tuple[discord.Message, str]] = {}
+        self._status_message: Optional[discord.Message] = None
+
+
+    @property
+    def channel_id(self) -> int:
+        return self._channel.id
+
+
+    def message_state(self) -> List[Tuple[int, Optional[str], Optional[str]]]:
+        state: List[Tuple[int, Optional[str], Optional[str]]] = []
+        state.extend((message.id, key, None) for key, message in self._active_messages.items())
+        state.extend((message.id, key, text) for key, (message, text) in self._ended_messages.items())
+        if self._status_message:
+            state.append((self._status_message.id, None, None))
+        return state
+
+
+    async def restore(self, state: List[Tuple[int, Optional[str], Optional[str]]], known_keys: Iterable[str]) -> None:
+        if not state:
+            return
+
+        # Walk the channel history forward from the oldest message we know about,
+        #  this fetches up to 100 messages per request instead of one request per message
+        wanted = {messageId: (key, text) for messageId, key, text in state}
+        try:
+            async for message in self._channel.history(limit=None, after=discord.Object(id=min(wanted) - 1)):
+                entry = wanted.pop(message.id, None)
+                if entry is None:
+                    continue
+                key, text = entry
+                if key is None:
+                    self._status_message = message
+                elif text is None:
+                    self._active_messages[key] = message
+                else:
+                    self._ended_messages[key] = (message, text)
+                if not wanted:
+                    break
+        except discord.DiscordException as discord_error:
+            logger.warning(repr(discord_error))
+
+        if wanted:
+            logger.warning(f'Unable to find {len(wanted)} previously sent messages in channel {self.channel_id}.')
+
+        # Games that ended before their message was struck through are gone from the known games,
+        #  their messages are marked as ended on the next publish instead of being left active forever
+        for key in set(self._active_messages).difference(known_keys):
+            message = self._active_messages.pop(key)
+            self._ended_messages[key] = (message, strike_game_message(message.content))
+
+
+    def has_pending_updates(self) -> bool:
+        return not self._status_message or len(self._ended_messages) != 0
+
+
+    async def _update_message(self, message: discord.Message, text: str) -> Optional[discord.Message]:
+        if message.content != text:
+            try:
+                message = await message.edit(content=text)
+            except discord.errors.NotFound:
+                return None
+        return message
+
+
+    async def _send_message(self, text: str) -> discord.Message:
+        return await self._channel.send(text)
+
+
+    async def publish(self, game_texts: Dict[str, str], ended_texts: Dict[str, str], status_text: str) -> None:
+        active_messages = self._active_messages
+        ended_messages = self._ended_messages
+        for key, text in ended_texts.items():
+            message = active_messages.pop(key, None)
+            if message:
+                ended_messages[key] = (message, text)
+
+        try:
+            for key, (message, text) in list(ended_messages.items()):
+                try:
+                    await self._update_message(message, text)
+                except ClientConnectorError as e:
+                    logger.warning('Connection error when attempting to mark a game as ended, assuming this is temporary and retrying next iteration.')
+                    continue
+                del ended_messages[key]
+
+            for key, message_text in game_texts.items():
+                if key in active_messages:
+                    try:
+                        maybeMessage = await self._update_message(active_messages[key], message_text)
+                    except ClientConnectorError as e:
+                        logger.warning('Connection error when attempting to update an active game message, assuming this is temporary and retrying next iteration.')
+                        continue
+                    assert maybeMessage is not None
+                    active_messages[key] = maybeMessage
+                elif self._status_message:
+                    # Reuse the status message for the new game so the status always stays below the game list
+                    maybeMessage = await self._update_message(self._status_message, message_text)
+                    assert maybeMessage is not None
+                    active_messages[key] = maybeMessage
+                    self._status_message = None
+                else:
+                    message = await self._send_message(message_text)
+                    assert message is not None
+                    active_messages[key] = message
+
+            if not self._status_message:
+                message = await self._send_message(status_text)
+                assert message is not None
+                self._status_message = message
+            else:
+                try:
+                    await self._update_message(self._status_message, status_text)
+                except ClientConnectorError as e:
+                    logger.warning('Connection error when attempting to update the game count message, assuming this is temporary and retrying next iteration.')
+        except discord.DiscordException as discord_error:
+            logger.warning(repr(discord_error))
+
+
 class GamebotClient(discord.Client):
     def __init__(self, *, intents: discord.Intents, **options: dict[str, Any]) -> None:
         intents.message_content = True
         super().__init__(intents=intents, **options)
         self._last_game_update: float | None = None
-        self._last_zt_update: float | None = None
         self._last_log: float | None = None
+        self._last_backlog_log: float | None = None
+        self._ended_games: Dict[str, Dict[str, Any]] = {}
+        self._publish_event = asyncio.Event()
+        self._publish_requested: float | None = None
 
 
     async def _register_commands(self, db: BotDatabase, zt: ZeroTierApiClient | None) -> None:
@@ -301,6 +504,15 @@ class GamebotClient(discord.Client):
                 if r: await interaction.response.send_message(content=chunk, ephemeral=True)
                 else: await interaction.followup.send(content=chunk, ephemeral=True)
 
+        @tree.command(name='stats', description='Shows game activity statistics.')
+        @discord.app_commands.describe(days='The number of days to include, defaults to 30.')
+        async def stats(interaction: discord.Interaction, days: discord.app_commands.Range[int, 1, 3650] = 30) -> None:
+            activity = await db.activity_stats(days)
+            if len(activity) == 0:
+                await interaction.response.send_message(content='No games recorded', ephemeral=True)
+                return
+            await interaction.response.send_message(content='\n'.join(activity), ephemeral=True)
+
         @tree.command(name='listbanned', description='List recently banned IP addresses.')
         async def listbanned(interaction: discord.Interaction) -> None:
             bans = await db.list_bans()
@@ -313,17 +525,48 @@ class GamebotClient(discord.Client):
                 if r: await interaction.response.send_message(content=chunk, ephemeral=True)
                 else: await interaction.followup.send(content=chunk, ephemeral=True)
 
-        @tree.command(name='ztban', description='Bans an IP address from using ZeroTier.')
-        @discord.app_commands.describe(ip='The physical IP address of the user.')
+        @tree.command(name='ztban', description='Bans an IP address or range from using ZeroTier.')
+        @discord.app_commands.describe(ip='The physical IP address of the user, or a CIDR prefix such as 203.0.113.0/24.')
         async def ztban(interaction: discord.Interaction, ip: str) -> None:
-            await db.ban(ip)
-            await interaction.response.send_message(content=f'IP {ip} banned', ephemeral=True)
+            try:
+                address = await db.ban(ip)
+            except ValueError:
+                await interaction.response.send_message(content=f'Invalid IP address or prefix: {ip}', ephemeral=True)
+                return
+            await interaction.response.send_message(content=f'IP {address} banned', ephemeral=True)
 
-        @tree.command(name='revokeztban', description='Revokes a previously banned IP address so it can use ZeroTier.')
-        @discord.app_commands.describe(ip='The physical IP address of the user.')
+        @tree.command(name='revokeztban', description='Revokes a previously banned IP address or range so it can use ZeroTier.')
+        @discord.app_commands.describe(ip='The physical IP address or CIDR prefix that was banned.')
         async def revokeztban(interaction: discord.Interaction, ip: str) -> None:
-            await db.remove_ban(ip)
-            await interaction.response.send_message(content=f'Revoked ban on {ip}', ephemeral=True)
+            address, removed = await db.remove_ban(ip)
+            if not removed:
+                await interaction.response.send_message(content=f'{address} is not banned', ephemeral=True)
+                return
+            await interaction.response.send_message(content=f'Revoked ban on {address}', ephemeral=True)
+
+        @tree.command(name='importztbans', description='Bans every IP address or range in a list, one per line.')
+        @discord.app_commands.describe(file='A text file containing the ban list.')
+        async def importztbans(interaction: discord.Interaction, file: discord.Attachment) -> None:
+            text = (await file.read()).decode('utf-8', errors='replace')
+            addresses, lineNumbers = parse_ban_list(text)
+            count, invalid = await db.ban_many(addresses)
+            lines = [f'Banned {count} IP addresses']
+            if invalid:
+                lines.append(format_line_numbers([lineNumbers[i] for i in invalid]))
+            for chunk in split_message(lines):
+                r = not interaction.response.is_done()
+                if r: await interaction.response.send_message(content=chunk, ephemeral=True)
+                else: await interaction.followup.send(content=chunk, ephemeral=True)
+
+        @tree.command(name='exportztbans', description='Exports all banned IP addresses and ranges as a file.')
+        async def exportztbans(interaction: discord.Interaction) -> None:
+            bans = await db.export_bans()
+            if len(bans) == 0:
+                await interaction.response.send_message(content='No IP bans', ephemeral=True)
+                return
+
+            file = discord.File(io.BytesIO(''.join(ban + '\n' for ban in bans).encode('utf-8')), filename='ztbans.txt')
+            await interaction.response.send_message(content=f'{len(bans)} IP bans', file=file, ephemeral=True)
 
         if zt:
             @tree.command(name='setztstatus', description='Updates the value of the status tag for a ZeroTier member.')
@@ -338,27 +581,23 @@ class GamebotClient(discord.Client):
                 await zt.tag_member(network, member, 'status', status)
                 await interaction.response.send_message(content=f'Status of member {memberid} updated to {status}', ephemeral=True)
 
-        await tree.sync()
-
-
-    async def _update_message(self, message: discord.Message, text: str) -> Optional[discord.Message]:
-        if message.content != text:
-            try:
-                message = await message.edit(content=text)
-            except discord.errors.NotFound:
-                return None
-        return message
-
+        # Syncing the command tree is slow and heavily rate limited, so only sync when the commands changed since the last sync
+        commands = sorted((command.to_dict(tree) for command in tree.get_commands()), key=lambda command: str(command['name']))
+        schema = json.dumps({'application_id': self.application_id, 'commands': commands}, sort_keys=True)
+        fingerprint = hashlib.sha256(schema.encode('utf-8')).hexdigest()
+        if await db.get_setting('CommandTreeFingerprint') == fingerprint:
+            logger.debug('Command tree unchanged, skipping sync.')
+            return
 
-    async def _send_message(self, text: str) -> discord.Message:
-        assert isinstance(self._channel, discord.TextChannel)
-        return await self._channel.send(text)
+        await tree.sync()
+        await db.set_setting('CommandTreeFingerprint', fingerprint)
 
 
-    async def _update_discord_channel(self, games: Any) -> None:
-        now = time.monotonic()
+    def _track_games(self, games: Any, now: float) -> int:
         timestamp = time.time()
         known_games = self._known_games
+        expiry_heap = self._expiry_heap
+        tracked = 0
         for game in games:
             if any_player_name_is_invalid(game['players']) or any_player_name_contains_a_banned_word(game['players']):
                 continue
@@ -370,93 +609,173 @@ class GamebotClient(discord.Client):
                 known_games[key] = game
                 known_games[key]['timestamp'] = timestamp
                 known_games[key]['first_seen'] = now
+                heapq.heappush(expiry_heap, (now + config['game_ttl'], key))
 
             known_games[key]['last_seen'] = now
+            tracked += 1
 
-        ended_games = [key for key, game in known_games.items() if now - game['last_seen'] >= config['game_ttl']]
+        return tracked
+
+
+    async def _ingest_games(self) -> None:
+        now = time.monotonic()
+        snapshots = []
+        for path in config['gamelist_files'] or [config['gamelist_file']]:
+            snapshot = read_snapshot(path)
+            if snapshot is None:
+                continue
+            if config['record_file'] != '':
+                record_snapshot(config['record_file'], path, snapshot)
+            snapshots.append((path, snapshot))
+
+        await self._ingest_snapshots(snapshots, now)
+
+
+    async def _ingest_snapshots(self, sourceSnapshots: List[Tuple[str, Dict[str, Any]]], now: float) -> None:
+        snapshots = []
+        for path, snapshot in sourceSnapshots:
+            self._sources[path] = (now, snapshot['games'])
+            snapshots.append(snapshot)
+
+        games = merge_games(snapshot['games'] for snapshot in snapshots)
+        sightings = merge_sightings(snapshot['player_sightings'] for snapshot in snapshots)
+        tracked = self._track_games(games, now)
+        self._hold_stalled_games(now)
+
+        # Ended games leave known_games right away, the publish stage picks them up from _ended_games
+        ended_games = pop_ended_games(self._expiry_heap, self._known_games, now)
+        sessions = []
+        at = datetime.now(UTC)
+        for key in ended_games:
+            game = self._known_games.pop(key)
+            game['ended'] = now
+            self._ended_games[key] = game
+            # The game was last seen game_ttl before it expired, that is when the session really ended
+            started_at = datetime.fromtimestamp(game['timestamp'], UTC)
+            ended_at = at - timedelta(seconds=now - game['last_seen'])
+            sessions.append((str(game['type']), str(game['version']), game['difficulty'], started_at, ended_at, round(game['last_seen'] - game['first_seen']), len(game['players'])))
+
+        if games or sightings or sessions:
+            if self._persist_queue.full():
+                logger.warning('Persist queue is full, ingest is waiting for the database.')
+            await self._persist_queue.put((games, sightings, sessions, at, len(self._known_games)))
 
-        active_messages = self._active_messages
         last_game_update = self._last_game_update
         last_log = self._last_log
-        if active_messages and not games and not ended_games:
+        if not any(publisher.has_pending_updates() for publisher in self._publishers) and not tracked and not ended_games:
             if last_game_update and now - last_game_update >= 60 and (not last_log or now - last_log >= 60):
                 logger.debug(f'No games seen in the last {round(now - last_game_update)} seconds.')
                 self._last_log = now
             return
 
-        active_games_text = '1 active game' if len(games) == 1 else f'{len(games)} active games'
+        active_games_text = '1 active game' if tracked == 1 else f'{tracked} active games'
         ended_games_text = '1 ended game' if len(ended_games) == 1 else f'{len(ended_games)} ended games'
         logger.debug(f'Updating game list with {active_games_text} and {ended_games_text}.')
         self._last_game_update = now
 
-        try:
-            for key in ended_games:
-                known_games[key]['ended'] = now
-                if active_messages:
-                    message = active_messages.popleft()
-                    try:
-                        await self._update_message(message, format_game_message(known_games[key]))
-                    except ClientConnectorError as e:
-                        logger.warning('Connection error when attempting to mark a game as ended, assuming this is temporary and retrying next iteration.')
-                        active_messages.appendleft(message)
-                        continue
-                del known_games[key]
+        # Publishing is latest-wins, requests made while a publish is in progress are coalesced into the next one
+        if not self._publish_event.is_set():
+            self._publish_requested = now
+            self._publish_event.set()
 
-            message_index = 0
-            for game in known_games.values():
-                message_text = format_game_message(game)
-                if message_index < len(active_messages):
-                    try:
-                        maybeMessage = await self._update_message(active_messages[message_index], message_text)
-                    except ClientConnectorError as e:
-                        logger.warning('Connection error when attempting to update an active game message, assuming this is temporary and retrying next iteration.')
-                        continue
-                    assert maybeMessage is not None
-                    active_messages[message_index] = maybeMessage
-                else:
-                    message = await self._send_message(message_text)
-                    assert message is not None
-                    active_messages.append(message)
-                message_index += 1
 
-            game_count = len(known_games)
-            if (len(active_messages) <= game_count):
-                message = await self._send_message(format_status_message(game_count))
-                assert message is not None
-                active_messages.append(message)
-            else:
-                try:
-                    await self._update_message(active_messages[game_count], format_status_message(game_count))
-                except ClientConnectorError as e:
-                    logger.warning('Connection error when attempting to update the game count message, assuming this is temporary and retrying next iteration.')
-                    return
+    async def _persist(self, db: BotDatabase, batch: PersistBatch) -> None:
+        games, sightings, sessions, at, game_count = batch
+        if games: await dump_games(games, db, at)
+        if sightings: await dump_sightings(sightings, db, at)
+        if sessions: await db.archive_sessions(sessions)
+        await db.record_concurrent_games(at, game_count)
+
+
+    async def _publish(self, db: BotDatabase) -> None:
+        # Render once and share the text between all channels
+        ended_games = self._ended_games
+        self._ended_games = {}
+        ended_texts = {key: format_game_message(game) for key, game in ended_games.items()}
+        game_texts = {key: format_game_message(game) for key, game in self._known_games.items()}
+        game_count = len(game_texts)
+        status_text = format_status_message(game_count)
 
+        # A failing channel must not keep the others, the saved state or the presence from updating
+        results = await asyncio.gather(*(publisher.publish(game_texts, ended_texts, status_text) for publisher in self._publishers), return_exceptions=True)
+        for publisher, result in zip(self._publishers, results):
+            if isinstance(result, Exception):
+                logger.error(f'Failed to publish to channel {publisher.channel_id}', exc_info=result)
+        await self._save_state(db)
+
+        try:
             activity = discord.Activity(name='Games online: '+str(game_count), type=discord.ActivityType.watching)
             await self.change_presence(activity=activity)
         except discord.DiscordException as discord_error:
             logger.warning(repr(discord_error))
 
 
-    async def _process_games(self, db: BotDatabase) -> None:
+    def _log_backlog(self, now: float) -> None:
+        if self._last_backlog_log and now - self._last_backlog_log < 60:
+            return
+
+        persist_backlog = self._persist_queue.qsize()
+        publish_lag = round(now - self._publish_requested) if self._publish_requested else 0
+        if persist_backlog or publish_lag:
+            logger.debug(f'Pipeline backlog: {persist_backlog} batches waiting to be persisted, publish pending for {publish_lag} seconds.')
+            self._last_backlog_log = now
+
+
+    async def _save_state(self, db: BotDatabase) -> None:
+        # Monotonic times are meaningless after a restart so they are stored as wall clock times
+        now = time.monotonic()
+        timestamp = time.time()
         games = []
-        sightings = []
-        try:
-            # Load the file as a JSON object
-            with open(config['gamelist_file']) as file:
-                gamelist_data = json.load(file)
-                games = gamelist_data["games"]
-                sightings = gamelist_data["player_sightings"]
+        for key, game in self._known_games.items():
+            data = {name: value for name, value in game.items() if name not in ('first_seen', 'last_seen')}
+            games.append((key, json.dumps(data), timestamp - (now - game['first_seen']), timestamp - (now - game['last_seen'])))
 
-            # Delete the file when we're done with it
-            pathlib.Path.unlink(config['gamelist_file'])
-        except FileNotFoundError:
-            pass
+        messages: List[Tuple[int, int, Optional[str], Optional[str]]] = []
+        for publisher in self._publishers:
+            for messageId, gameKey, text in publisher.message_state():
+                messages.append((messageId, publisher.channel_id, gameKey, text))
 
-        tasks = []
-        tasks.append(self.loop.create_task(self._update_discord_channel(games)))
-        if games: tasks.append(self.loop.create_task(dump_games(games, db)))
-        if sightings: tasks.append(self.loop.create_task(dump_sightings(sightings, db)))
-        await asyncio.gather(*tasks)
+        await db.save_game_state(games, messages)
+
+
+    async def _restore_state(self, db: BotDatabase) -> None:
+        now = time.monotonic()
+        timestamp = time.time()
+        for key, data, firstSeen, lastSeen in await db.load_known_games():
+            game = json.loads(data)
+            game['first_seen'] = now - (timestamp - firstSeen)
+            game['last_seen'] = now - (timestamp - lastSeen)
+            self._known_games[key] = game
+            heapq.heappush(self._expiry_heap, (game['last_seen'] + config['game_ttl'], key))
+
+        for publisher in self._publishers:
+            await publisher.restore(await db.load_channel_messages(publisher.channel_id), self._known_games.keys())
+
+        logger.debug(f'Restored {len(self._known_games)} known games from the database.')
+
+
+    def _hold_stalled_games(self, now: float) -> None:
+        sources = self._sources
+        if not sources:
+            return
+
+        # A producer going quiet is normal once its last game ends, so held games are never treated as seen again.
+        #  A producer that went quiet for game_ttl/2 while another one keeps reporting may have stalled instead.
+        #  From then on, for up to source_ttl seconds, the games from its last snapshot are kept alive,
+        #  so they expire at most source_ttl (capped at 120) seconds later than they otherwise would.
+        hold = min(config['source_ttl'], 120)
+        stalled_after = config['game_ttl'] / 2
+        newest = max(last for last, _ in sources.values())
+        known_games = self._known_games
+        for path, (last, games) in list(sources.items()):
+            age = now - last
+            if age >= stalled_after + hold:
+                del sources[path]
+            elif age >= stalled_after and now - newest < stalled_after:
+                for game in games:
+                    known_game = known_games.get(game['id'].upper())
+                    if known_game is not None:
+                        known_game['last_seen'] = max(known_game['last_seen'], min(now, last + hold))
 
 
     async def _process_zt_members(self, zt: ZeroTierApiClient, db: BotDatabase) -> None:
@@ -469,46 +788,105 @@ class GamebotClient(discord.Client):
         await apply_ip_bans(network, members, db, zt)
 
 
-    async def _background_task(self) -> None:
-        await self.wait_until_ready()
+    def _init_pipeline(self, channels: List[discord.TextChannel]) -> None:
+        self._publishers: List[ChannelPublisher] = [ChannelPublisher(channel) for channel in channels]
+        self._sources: Dict[str, Tuple[float, List[Dict[str, Any]]]] = {}
+        self._known_games: Dict[str, Dict[str, Any]] = {}
+        self._expiry_heap: List[Tuple[float, str]] = []
+        self._persist_queue: asyncio.Queue[PersistBatch] = asyncio.Queue(maxsize=config['persist_queue_size'])
 
-        logger.debug('Connection established for the first time, preparing for loop start.')
 
-        maybeChannel = self.get_channel(config['channel'])
-        assert isinstance(maybeChannel, discord.TextChannel)
+    # The stages only share in-memory state and the queue, so a slow Discord or ZeroTier API
+    #  never holds back reading snapshots or writing sightings to the database
+    async def _ingest_stage(self) -> None:
+        while not self.is_closed():
+            try:
+                await asyncio.sleep(1)
+                await self._ingest_games()
+                self._log_backlog(time.monotonic())
+            except Exception as e:
+                logger.exception('Unknown exception occurred: ')
 
-        self._channel = maybeChannel
-        self._known_games: Dict[str, Dict[str, Any]] = {}
-        self._active_messages: Deque[discord.Message] = deque()
 
-        async def main_loop(db: BotDatabase, zt: ZeroTierApiClient | None) -> None:
-            while not self.is_closed():
-                try:
-                    await asyncio.sleep(1)
+    async def _persist_stage(self, db: BotDatabase) -> None:
+        while not self.is_closed():
+            batch = await self._persist_queue.get()
+            try:
+                await self._persist(db, batch)
+            except Exception as e:
+                logger.exception('Unknown exception occurred: ')
+            finally:
+                self._persist_queue.task_done()
+
+
+    async def _publish_stage(self, db: BotDatabase) -> None:
+        while not self.is_closed():
+            await self._publish_event.wait()
+            self._publish_event.clear()
+            self._publish_requested = None
+            try:
+                await self._publish(db)
+            except Exception as e:
+                logger.exception('Unknown exception occurred: ')
+
+
+    async def _zt_stage(self, db: BotDatabase, zt: ZeroTierApiClient) -> None:
+        while not self.is_closed():
+            try:
+                await self._process_zt_members(zt, db)
+            except Exception as e:
+                logger.exception('Unknown exception occurred: ')
+            await asyncio.sleep(60)
+
+
+    async def _clean_up_stage(self, db: BotDatabase) -> None:
+        # Pruning names scans the whole dictionary and blocks sightings from being written meanwhile, so it only runs hourly
+        last_prune = time.monotonic()
+        while not self.is_closed():
+            try:
+                await asyncio.sleep(1)
+                await db.clean_up()
+                if time.monotonic() - last_prune >= 3600:
+                    last_prune = time.monotonic()
+                    await db.prune_names()
+            except Exception as e:
+                logger.exception('Unknown exception occurred: ')
+
+
+    async def _backup_stage(self, db: BotDatabase) -> None:
+        while not self.is_closed():
+            await asyncio.sleep(config['backup_interval'])
+            try:
+                started = time.monotonic()
+                await db.backup(config['backup_file'], config['backup_count'])
+                logger.debug(f'Backed up database to {config["backup_file"]} in {time.monotonic() - started:.1f} seconds.')
+            except Exception as e:
+                logger.exception('Unable to back up database: ')
 
-                    now = time.monotonic()
-                    zt_api_is_ready = not self._last_zt_update or now - self._last_zt_update >= 60
 
-                    tasks = []
-                    tasks.append(self.loop.create_task(self._process_games(db)))
-                    if zt and zt_api_is_ready:
-                        tasks.append(self.loop.create_task(self._process_zt_members(zt, db)))
-                        self._last_zt_update = now
-                    tasks.append(self.loop.create_task(db.clean_up()))
-                    await asyncio.gather(*tasks)
-                except Exception as e:
-                    logger.exception('Unknown exception occurred: ')
+    async def _background_task(self) -> None:
+        await self.wait_until_ready()
+
+        logger.debug('Connection established for the first time, preparing for loop start.')
+
+        channels = []
+        for channelId in config['channels'] or [config['channel']]:
+            maybeChannel = self.get_channel(channelId)
+            assert isinstance(maybeChannel, discord.TextChannel)
+            channels.append(maybeChannel)
+        self._init_pipeline(channels)
 
         try:
             async with BotDatabase() as db:
                 async with ZeroTierApiClient(config['zt_token']) as zt:
                     maybeZt = zt if config['zt_token'] != '' else None
+                    await self._restore_state(db)
                     await self._register_commands(db, maybeZt)
-                    while True:
-                        logger.debug('Starting main loop')
-                        await main_loop(db, maybeZt)
-                        logger.debug('Connection lost, waiting for reconnect')
-                        await self.wait_until_ready()
+                    logger.debug('Starting pipeline stages')
+                    stages = [self._ingest_stage(), self._persist_stage(db), self._publish_stage(db), self._clean_up_stage(db)]
+                    if maybeZt: stages.append(self._zt_stage(db, maybeZt))
+                    if config['backup_interval'] > 0: stages.append(self._backup_stage(db))
+                    await asyncio.gather(*stages)
         except Exception as e:
             logger.exception('Unknown exception occurred: ')
 
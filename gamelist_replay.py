@@ -0,0 +1,179 @@
+import argparse
+import asyncio
+import discord
+import gzip
+import json
+import logging
+import time
+from bot_db import BotDatabase
+from discord_bot import GamebotClient, config
+from typing import Any, Dict, Iterator, List, Optional, Tuple, cast
+
+logger = logging.getLogger(__name__)
+
+
+def read_recording(path: str) -> Iterator[Tuple[float, str, Dict[str, Any]]]:
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                yield record['timestamp'], record['source'], record['snapshot']
+    except (EOFError, json.JSONDecodeError):
+        # The bot may have been stopped halfway through appending the last snapshot
+        logger.warning('Recording ends with a truncated snapshot, ignoring it')
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def format_latencies(values: List[float]) -> str:
+    p50 = percentile(values, 0.5) * 1000
+    p95 = percentile(values, 0.95) * 1000
+    p100 = max(values, default=0.0) * 1000
+    return f'p50 {p50:.2f} ms, p95 {p95:.2f} ms, max {p100:.2f} ms'
+
+
+class FakeMessage:
+    def __init__(self, channel: 'FakeChannel', id: int, content: str) -> None:
+        self._channel = channel
+        self.id = id
+        self.content = content
+
+    async def edit(self, *, content: str) -> 'FakeMessage':
+        await self._channel.api_call()
+        self._channel.edits += 1
+        self.content = content
+        return self
+
+
+class FakeChannel:
+    def __init__(self, id: int, latency: float) -> None:
+        self.id = id
+        self.messages: List[FakeMessage] = []
+        self.sends = 0
+        self.edits = 0
+        self._latency = latency
+
+    async def api_call(self) -> None:
+        if self._latency > 0:
+            await asyncio.sleep(self._latency)
+
+    async def send(self, content: str) -> FakeMessage:
+        await self.api_call()
+        self.sends += 1
+        message = FakeMessage(self, (self.id << 32) + len(self.messages), content)
+        self.messages.append(message)
+        return message
+
+
+class ReplayClient(GamebotClient):
+    def __init__(self, *, intents: discord.Intents) -> None:
+        super().__init__(intents=intents)
+        self.publish_latencies: List[float] = []
+        self.publishing = False
+
+    async def change_presence(self, **kwargs: Any) -> None:
+        pass
+
+    async def _save_state(self, db: BotDatabase) -> None:
+        # The fake channels' message ids mean nothing to the live bot, never overwrite its saved state
+        pass
+
+    async def _publish(self, db: BotDatabase) -> None:
+        self.publishing = True
+        started = time.perf_counter()
+        try:
+            await super()._publish(db)
+        finally:
+            self.publish_latencies.append(time.perf_counter() - started)
+            self.publishing = False
+
+
+async def replay(path: str, speed: float, dbPath: str, channelCount: int, latency: float) -> None:
+    client = ReplayClient(intents=discord.Intents.default())
+    channels = [FakeChannel(i + 1, latency) for i in range(channelCount)]
+    client._init_pipeline(cast(List[discord.TextChannel], channels))
+
+    records = read_recording(path)
+    pending = next(records, None)
+    if pending is None:
+        logger.warning(f'No snapshots recorded in {path}')
+        return
+
+    async with BotDatabase(dbPath) as db:
+        stages = [asyncio.create_task(client._persist_stage(db)), asyncio.create_task(client._publish_stage(db))]
+
+        # Recorded time drives the bot's clock one tick per recorded second, like the ingest stage does live.
+        #  Ticks keep going for game_ttl after the last snapshot so the remaining games end as well.
+        start = pending[0]
+        tick = start
+        end: Optional[float] = None
+        snapshotCount = 0
+        gameCount = 0
+        tickLatencies: List[float] = []
+        started = time.perf_counter()
+        while end is None or tick < end:
+            tick += 1
+            batch = []
+            while pending is not None and pending[0] <= tick:
+                _, source, snapshot = pending
+                batch.append((source, snapshot))
+                gameCount += len(snapshot['games'])
+                pending = next(records, None)
+            snapshotCount += len(batch)
+            if pending is None and end is None:
+                end = tick + config['game_ttl'] + 1
+
+            tickStarted = time.perf_counter()
+            await client._ingest_snapshots(batch, tick - start)
+            tickLatencies.append(time.perf_counter() - tickStarted)
+
+            if speed > 0:
+                await asyncio.sleep(max(0.0, started + (tick - start) / speed - time.perf_counter()))
+            else:
+                await asyncio.sleep(0)
+
+        await client._persist_queue.join()
+        while client._publish_event.is_set() or client.publishing:
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - started
+
+        for stage in stages:
+            stage.cancel()
+        await asyncio.gather(*stages, return_exceptions=True)
+
+    recorded = tick - start
+    print(f'Replayed {snapshotCount} snapshots with {gameCount} games covering {recorded:.0f} recorded seconds in {elapsed:.2f} seconds')
+    print(f'Throughput: {snapshotCount / elapsed:.1f} snapshots/s, {len(tickLatencies) / elapsed:.1f} ticks/s')
+    print(f'Ingest tick latency: {format_latencies(tickLatencies)}')
+    print(f'Publishes: {len(client.publish_latencies)}, latency {format_latencies(client.publish_latencies)}')
+    for channel in channels:
+        print(f'Channel {channel.id}: {channel.sends} messages sent, {channel.edits} edits')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Replays a recorded gamelist log through the bot against fake Discord channels.')
+    parser.add_argument('recording', help='The compressed snapshot log written by the bot when record_file is set.')
+    parser.add_argument('--speed', type=float, default=0, help='Replay speed relative to the recording, e.g. 1 or 10. 0 replays as fast as possible.')
+    parser.add_argument('--db', default=':memory:', help='The database to write sightings to, defaults to an in-memory database. Saved game and message state is never overwritten.')
+    parser.add_argument('--channels', type=int, default=1, help='The number of fake channels to publish to.')
+    parser.add_argument('--discord-latency', type=float, default=0, help='Simulated latency of every Discord API call in seconds.')
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.WARNING,
+        format='[{asctime}] [{levelname:<8}] {name}: {message}',
+        datefmt='',
+        style='{')
+
+    asyncio.run(replay(args.recording, args.speed, args.db, args.channels, args.discord_latency))
+
+
+if __name__ == '__main__':
+    main()